@@ -5,115 +5,196 @@ Streamlit Web App for DGT Parser POC
 import streamlit as st
 import tempfile
 import os
+import shutil
+import hashlib
 import pandas as pd
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Tuple
 import sys
 
 # Add src to path
 sys.path.append('src')
 
-from src.pdf_parser import DGTParser
-from src.business_logic import BusinessLogic
-
-# Page config
-st.set_page_config(
-    page_title="DGT Parser POC",
-    page_icon="🚛",
-    layout="wide"
-)
-
-# Title
-st.title("🚛 DGT Vehicle Report Processor")
-st.markdown("**POC** - Proof of Concept for Travis Dayton")
-
-st.markdown("---")
-
-# Sidebar - Configuration
-with st.sidebar:
-    st.header("⚙️ Configuration")
-    cliente_nif = st.text_input(
-        "Client NIF/CIF (Optional)",
-        placeholder="EMPRESA SL",
-        help="Leave empty to process all vehicles"
-    )
+from src.business_logic import OUTPUT_KEYS
+from src.worker import LazyExecutor, process_one
+
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=1000)
+def parse_and_process(pdf_hash: str, cliente_nif: Optional[str], _uploaded_file, _executor) -> dict:
+    """
+    Parse one PDF and apply business rules, cached by file content
+
+    Streamlit reruns the whole script on every interaction; keying on the
+    PDF content hash means already-seen files are never parsed twice.
+    Leading-underscore arguments are left out of the cache key. Verdicts
+    depend on today's date (active renting, ITV cutoff, renting age), so
+    entries expire after an hour; max_entries bounds server memory.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pdf_path = os.path.join(tmpdir, 'report.pdf')
+        
+        # Stream to disk in 1 MiB chunks instead of materializing getvalue()
+        _uploaded_file.seek(0)
+        with open(pdf_path, 'wb') as f:
+            shutil.copyfileobj(_uploaded_file, f, length=1024 * 1024)
+        
+        return _executor.submit(process_one, pdf_path, cliente_nif).result()
+
+
+# Display column per raw result key, in business_logic.OUTPUT_KEYS order
+DISPLAY_COLUMNS = dict(zip(OUTPUT_KEYS, (
+    'Matrícula',
+    'Fecha penúlti',
+    'Lectura k (penúlti)',
+    'Fecha últ',
+    'Lectura k (últ)',
+    'Días entre',
+    'km ITVs',
+    'km 1 año',
+    'km int',
+    'km nac',
+    'Comentarios',
+), strict=True))
+
+
+# Per-vehicle expanders are costly to render; cap them for large batches
+MAX_DETAIL_ROWS = 50
+
+
+def results_to_dataframe(results: list) -> pd.DataFrame:
+    """Build the display table from raw result dicts with column-wise formatting"""
+    df = pd.DataFrame(results, columns=OUTPUT_KEYS)
     
-    st.markdown("---")
-    st.info("📋 **Instructions:**\n\n1. Upload DGT PDF reports\n2. Click 'Process PDFs'\n3. View results table\n4. Download CSV")
-
-# File uploader
-st.header("📄 Upload DGT Reports")
-uploaded_files = st.file_uploader(
-    "Drop PDF files here or click to browse",
-    type=['pdf'],
-    accept_multiple_files=True,
-    help="Upload one or more DGT 'Informe del Vehículo' PDFs"
-)
-
-if uploaded_files:
-    st.success(f"✅ {len(uploaded_files)} PDF(s) uploaded")
+    for col in ('fecha_penulti', 'fecha_ult'):
+        df[col] = pd.to_datetime(df[col]).dt.strftime('%d/%m/%Y').fillna('-')
+    df['comentarios'] = df['comentarios'].str.join('; ').fillna('')
     
-    # Show uploaded files
-    with st.expander("📋 Uploaded Files"):
-        for file in uploaded_files:
-            st.text(f"• {file.name} ({file.size / 1024:.1f} KB)")
+    return df.rename(columns=DISPLAY_COLUMNS)
+
+
+def compute_summary(df: pd.DataFrame) -> Tuple[int, int, int]:
+    """
+    Summary metrics: total, with km calculations, without comments
+
+    Not st.cache_data: hashing the DataFrame for the cache key is itself a
+    full pass and costs more than the two vectorized comparisons.
+    """
+    has_calculations = df['km 1 año'].to_numpy() > 0
+    no_comments = df['Comentarios'].to_numpy() == ''
+    return len(df), int(has_calculations.sum()), int(no_comments.sum())
+
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=20)
+def df_to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """
+    Encode the results table as CSV once per unique DataFrame
+
+    Each entry holds a whole batch's CSV, so only the most recent few are
+    kept, and they expire together with parse_and_process results.
+    """
+    return df.to_csv(index=False).encode('utf-8')
 
-# Process button
-if st.button("🚀 Process PDFs", type="primary", disabled=not uploaded_files):
+
+# Page footer (raw HTML, so kept unindented)
+FOOTER_HTML = """
+<div style='text-align: center; color: gray; padding: 20px;'>
+    <p><strong>DGT Parser POC</strong> - Developed by Facundo Solis for Travis Dayton</p>
+    <p>Technology: Python + pdfplumber + pandas</p>
+</div>
+"""
+
+
+def main():
+    """Render the Streamlit page"""
+    # Page config
+    st.set_page_config(
+        page_title="DGT Parser POC",
+        page_icon="🚛",
+        layout="wide"
+    )
+
+    # Title
+    st.title("🚛 DGT Vehicle Report Processor")
+    st.markdown("**POC** - Proof of Concept for Travis Dayton")
+
+    st.markdown("---")
     
-    # Create temp directory
-    with tempfile.TemporaryDirectory() as tmpdir:
+    # Sidebar - Configuration
+    with st.sidebar:
+        st.header("⚙️ Configuration")
+        cliente_nif = st.text_input(
+            "Client NIF/CIF (Optional)",
+            placeholder="EMPRESA SL",
+            help="Leave empty to process all vehicles"
+        )
+        
+        st.markdown("---")
+        st.info("📋 **Instructions:**\n\n1. Upload DGT PDF reports\n2. Click 'Process PDFs'\n3. View results table\n4. Download CSV")
+
+    # File uploader
+    st.header("📄 Upload DGT Reports")
+    uploaded_files = st.file_uploader(
+        "Drop PDF files here or click to browse",
+        type=['pdf'],
+        accept_multiple_files=True,
+        help="Upload one or more DGT 'Informe del Vehículo' PDFs"
+    )
+
+    if uploaded_files:
+        st.success(f"✅ {len(uploaded_files)} PDF(s) uploaded")
+        
+        # Show uploaded files
+        with st.expander("📋 Uploaded Files"):
+            for file in uploaded_files:
+                st.text(f"• {file.name} ({file.size / 1024:.1f} KB)")
+
+    # Process button
+    if st.button("🚀 Process PDFs", type="primary", disabled=not uploaded_files):
         
         # Progress bar
         progress_bar = st.progress(0)
         status_text = st.empty()
         
-        # Save uploaded files
-        pdf_paths = []
-        for i, uploaded_file in enumerate(uploaded_files):
-            file_path = os.path.join(tmpdir, uploaded_file.name)
-            with open(file_path, 'wb') as f:
-                f.write(uploaded_file.getvalue())
-            pdf_paths.append(file_path)
+        # Process PDFs in parallel - each PDF is independent. Threads only wait
+        # on the cache / process pool; parsing runs in the worker processes,
+        # which are only started on the first cache miss.
+        results = [None] * len(uploaded_files)
+        max_workers = min(os.cpu_count() or 1, 8)
+        nif = cliente_nif if cliente_nif else None
         
-        # Initialize business logic
-        logic = BusinessLogic(cliente_nif=cliente_nif if cliente_nif else None)
-        
-        # Process PDFs
-        results = []
-        for i, pdf_path in enumerate(pdf_paths):
+        with LazyExecutor(nif, max_workers) as pool, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    parse_and_process,
+                    hashlib.sha256(uploaded_file.getbuffer()).hexdigest(),
+                    nif,
+                    uploaded_file,
+                    pool
+                ): i
+                for i, uploaded_file in enumerate(uploaded_files)
+            }
             
-            # Update progress
-            progress = (i + 1) / len(pdf_paths)
-            progress_bar.progress(progress)
-            status_text.text(f"Processing {Path(pdf_path).name}... ({i+1}/{len(pdf_paths)})")
+            # Each progress update is a browser round trip - send at most ~100
+            total = len(uploaded_files)
+            step = max(1, total // 100)
             
-            try:
-                # Parse PDF
-                parser = DGTParser(pdf_path)
-                data = parser.parse()
-                
-                # Apply business logic
-                result = logic.process_vehicle(data)
-                
-                # Format for display
-                row = {
-                    'Matrícula': result['matricula'],
-                    'Fecha penúlti': result['fecha_penulti'].strftime('%d/%m/%Y') if result['fecha_penulti'] else '-',
-                    'Lectura k (penúlti)': result['lectura_k_penulti'],
-                    'Fecha últ': result['fecha_ult'].strftime('%d/%m/%Y') if result['fecha_ult'] else '-',
-                    'Lectura k (últ)': result['lectura_k_ult'],
-                    'Días entre': result['dias_entre'],
-                    'km ITVs': result['km_itvs'],
-                    'km 1 año': result['km_1_ano'],
-                    'km int': result['km_int'],
-                    'km nac': result['km_nac'],
-                    'Comentarios': '; '.join(result['comentarios']) if result['comentarios'] else ''
-                }
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                file_name = uploaded_files[i].name
                 
-                results.append(row)
+                # Update progress
+                if done % step == 0 or done == total:
+                    progress_bar.progress(done / total)
+                    status_text.text(f"Processed {file_name}... ({done}/{total})")
                 
-            except Exception as e:
-                st.error(f"❌ Error processing {Path(pdf_path).name}: {str(e)}")
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    st.error(f"❌ Error processing {file_name}: {str(e)}")
+        
+        # Keep upload order, drop failed PDFs
+        results = [result for result in results if result is not None]
         
         # Clear progress
         progress_bar.empty()
@@ -125,18 +206,17 @@ if st.button("🚀 Process PDFs", type="primary", disabled=not uploaded_files):
             st.header("📊 Results")
             
             # Convert to DataFrame
-            df = pd.DataFrame(results)
+            df = results_to_dataframe(results)
             
             # Summary metrics
+            total, with_calculations, ready = compute_summary(df)
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Total Vehicles", len(df))
+                st.metric("Total Vehicles", total)
             with col2:
-                has_calculations = df['km 1 año'] > 0
-                st.metric("With Calculations", has_calculations.sum())
+                st.metric("With Calculations", with_calculations)
             with col3:
-                no_comments = df['Comentarios'] == ''
-                st.metric("Ready to Process", no_comments.sum())
+                st.metric("Ready to Process", ready)
             
             st.markdown("---")
             
@@ -148,7 +228,7 @@ if st.button("🚀 Process PDFs", type="primary", disabled=not uploaded_files):
             )
             
             # Download button
-            csv = df.to_csv(index=False).encode('utf-8')
+            csv = df_to_csv_bytes(df)
             st.download_button(
                 label="📥 Download CSV",
                 data=csv,
@@ -160,7 +240,14 @@ if st.button("🚀 Process PDFs", type="primary", disabled=not uploaded_files):
             st.markdown("---")
             st.subheader("🔍 Vehicle Details")
             
-            for idx, row in df.iterrows():
+            if len(df) > MAX_DETAIL_ROWS:
+                st.caption(
+                    f"Showing details for the first {MAX_DETAIL_ROWS} of {len(df)} vehicles - "
+                    "see the results table above for the full list"
+                )
+            
+            # Plain dicts are much lighter than the Series built by iterrows()
+            for row in df.head(MAX_DETAIL_ROWS).to_dict('records'):
                 with st.expander(f"🚗 {row['Matrícula']}"):
                     col1, col2 = st.columns(2)
                     
@@ -180,11 +267,12 @@ if st.button("🚀 Process PDFs", type="primary", disabled=not uploaded_files):
                     if row['Comentarios']:
                         st.warning(f"⚠️ {row['Comentarios']}")
 
-# Footer
-st.markdown("---")
-st.markdown("""
-<div style='text-align: center; color: gray; padding: 20px;'>
-    <p><strong>DGT Parser POC</strong> - Developed by Facundo Solis for Travis Dayton</p>
-    <p>Technology: Python + pdfplumber + pandas</p>
-</div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+    # Footer
+    st.markdown("---")
+    st.markdown(FOOTER_HTML, unsafe_allow_html=True)
+
+
+# Streamlit runs this script as __main__; worker processes started with
+# forkserver/spawn re-import it as __mp_main__ and must not render the page
+if __name__ == "__main__":
+    main()
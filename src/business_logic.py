@@ -3,8 +3,35 @@ Business Logic - DGT Vehicle Processing Rules
 """
 
 from datetime import datetime
-from typing import Dict, List, Optional, Any
-from .pdf_parser import VehicleData
+from typing import Dict, Optional, Any
+from .pdf_parser import VehicleData, normalize_text
+
+# Bajas and titularidad/renting changes are only reported from this date
+_CUTOFF = datetime(2023, 1, 1)
+
+# Average month length, as a multiplier to turn days into months
+_MONTHS_PER_DAY = 1 / 30.44
+
+
+# ITV results that invalidate an inspection. DGTParser emits single-token
+# codes (FAVORABLE, FAVORABLE_CON, DESFAVORABLE, NEGATIVA), so exact
+# membership is enough
+_BAD_RESULTS = frozenset({'DESFAVORABLE', 'NEGATIVA'})
+
+# Result keys in output column order, shared by the CSV writer and the app
+OUTPUT_KEYS = [
+    'matricula',
+    'fecha_penulti',
+    'lectura_k_penulti',
+    'fecha_ult',
+    'lectura_k_ult',
+    'dias_entre',
+    'km_itvs',
+    'km_1_ano',
+    'km_int',
+    'km_nac',
+    'comentarios',
+]
 
 
 class BusinessLogic:
@@ -12,36 +39,59 @@ class BusinessLogic:
     
     def __init__(self, cliente_nif: Optional[str] = None):
         self.cliente_nif = cliente_nif
+        
+        # Single reference "now" so every vehicle in a batch is judged alike
+        self._now = datetime.now()
+        
+        # Client forms used by _matches_client, computed once per instance
+        self._cliente_norm = self._normalize_text(cliente_nif) if cliente_nif else None
+        self._cliente_nospace = self._cliente_norm.replace(' ', '') if self._cliente_norm is not None else None
     
-    def _normalize_text(self, text: str) -> str:
-        """Normalize text for comparison (remove extra spaces, uppercase)"""
-        return ' '.join(text.upper().split())
+    @staticmethod
+    def _normalize_text(text: str) -> str:
+        """Normalize text for comparison - shared with DGTParser's precomputed filiacion_norm"""
+        return normalize_text(text)
 
-    def _matches_client(self, text: str) -> bool:
-        """Check if text matches client with flexible matching"""
+    def _matches_client(self, text: str, text_normalized: Optional[str] = None) -> bool:
+        """
+        Check if text matches client with flexible matching
+        
+        text_normalized: _normalize_text(text) if already known (DGTParser
+        precomputes it for history rows), saving the per-call normalization
+        """
         if not self.cliente_nif:
             return True
         
-        # Normalize both texts
-        text_normalized = self._normalize_text(text)
-        cliente_normalized = self._normalize_text(self.cliente_nif)
+        cliente_normalized = self._cliente_norm
         
-        # Check if client name is substring of text
-        if cliente_normalized in text_normalized:
+        if text_normalized is None:
+            # Fast path: client appears verbatim - one allocation per candidate.
+            # A hit here implies a hit on the normalized text below.
+            text_upper = text.upper()
+            if cliente_normalized in text_upper:
+                return True
+            
+            # Normalize text (client is pre-normalized in __init__)
+            text_normalized = self._normalize_text(text_upper)
+        
+        # Substring in either direction: only the shorter can be in the longer
+        if len(text_normalized) < len(cliente_normalized):
+            if text_normalized in cliente_normalized:
+                return True
+        elif cliente_normalized in text_normalized:
             return True
         
-        # Check if text is substring of client
-        if text_normalized in cliente_normalized:
-            return True
+        # Without spaces the forms are identical to the ones just compared
+        if ' ' not in text_normalized and ' ' not in cliente_normalized:
+            return False
         
         # Check without spaces (handles "IN MEDIATO" vs "INMEDIATO")
         text_no_spaces = text_normalized.replace(' ', '')
-        cliente_no_spaces = cliente_normalized.replace(' ', '')
-        
-        if cliente_no_spaces in text_no_spaces or text_no_spaces in cliente_no_spaces:
-            return True
+        cliente_no_spaces = self._cliente_nospace
         
-        return False
+        if len(text_no_spaces) < len(cliente_no_spaces):
+            return text_no_spaces in cliente_no_spaces
+        return cliente_no_spaces in text_no_spaces
     
     def process_vehicle(self, data: VehicleData) -> Dict[str, Any]:
         """Process vehicle through all business rules"""
@@ -96,7 +146,7 @@ class BusinessLogic:
             
             for arrendatario in data.historial_arrendatarios:
                 filiacion = arrendatario.get('filiacion', '')
-                if not self._matches_client(filiacion):
+                if not self._matches_client(filiacion, arrendatario.get('filiacion_norm')):
                     continue
                 
                 fecha_inicio = arrendatario.get('fecha_inicio')
@@ -106,12 +156,12 @@ class BusinessLogic:
                     # If fecha_fin is None, renting is currently active
                     if fecha_fin is None:
                         # Calculate months from start to today
-                        meses = (datetime.now() - fecha_inicio).days / 30.44
+                        meses = (self._now - fecha_inicio).days * _MONTHS_PER_DAY
                         if meses > 14:
                             return True
                     else:
                         # Calculate months between start and end
-                        meses = (fecha_fin - fecha_inicio).days / 30.44
+                        meses = (fecha_fin - fecha_inicio).days * _MONTHS_PER_DAY
                         if meses > 14:
                             return True
             
@@ -121,13 +171,11 @@ class BusinessLogic:
 
     def _check_titularidad_renting_changes(self, data: VehicleData, result: Dict):
         """Check if titularidad or renting changed after 01/01/2023"""
-        cutoff_date = datetime(2023, 1, 1)
-        
         # Check titularidad changes - ALWAYS report (not just for client)
         for titular in data.historial_titulares:
             fecha_inicio = titular.get('fecha_inicio')
             
-            if fecha_inicio and fecha_inicio >= cutoff_date:
+            if fecha_inicio and fecha_inicio >= _CUTOFF:
                 fecha_str = fecha_inicio.strftime('%d/%m/%Y')
                 result['comentarios'].append(f"Cambio de titularidad el {fecha_str}")
                 break  # Only report the most recent change
@@ -141,12 +189,12 @@ class BusinessLogic:
             fecha_fin = arrendatario.get('fecha_fin')
             
             # Report if renting started after cutoff
-            if fecha_inicio and fecha_inicio >= cutoff_date:
+            if fecha_inicio and fecha_inicio >= _CUTOFF:
                 fecha_str = fecha_inicio.strftime('%d/%m/%Y')
                 result['comentarios'].append(f"Inicio de renting el {fecha_str}")
             
             # Report if renting ended after cutoff
-            if fecha_fin and fecha_fin >= cutoff_date:
+            if fecha_fin and fecha_fin >= _CUTOFF:
                 fecha_str = fecha_fin.strftime('%d/%m/%Y')
                 result['comentarios'].append(f"Fin de renting el {fecha_str}")
             
@@ -156,13 +204,11 @@ class BusinessLogic:
     
     def _check_bajas(self, data: VehicleData, result: Dict):
         """Check if vehicle has BAJAS after 01/01/2023"""
-        cutoff_date = datetime(2023, 1, 1)
-        
         for baja in data.historial_bajas:
             fecha_inicio = baja.get('fecha_inicio')
             fecha_fin = baja.get('fecha_fin')
             
-            if fecha_inicio and fecha_inicio >= cutoff_date:
+            if fecha_inicio and fecha_inicio >= _CUTOFF:
                 fecha_inicio_str = fecha_inicio.strftime('%d/%m/%Y')
                 fecha_fin_str = fecha_fin.strftime('%d/%m/%Y') if fecha_fin else 'Actual'
                 
@@ -182,59 +228,53 @@ class BusinessLogic:
             result['comentarios'].append("Sin historial de ITVs")
             return
         
-        # Sort ITVs by date (most recent first)
-        itvs_sorted = sorted(
-            data.historial_itvs,
-            key=lambda x: x['fecha_itv'] if x['fecha_itv'] else datetime.min,
-            reverse=True
-        )
+        def itv_date(itv):
+            return itv['fecha_itv'] if itv['fecha_itv'] else datetime.min
         
-        # Filter valid ITVs
-        valid_itvs = []
+        # Single pass over the history: only the most recent valid ITV and the
+        # two most recent ITVs with km are needed, so no full sort. Strict '>'
+        # keeps the first of equal dates, same as a stable sort would.
+        latest_valid = None
+        ultima = None       # Most recent valid ITV with km > 0
+        penultima = None    # Second most recent valid ITV with km > 0
+        count_with_km = 0
         
-        for itv in itvs_sorted:
-            resultado = itv.get('resultado', '').upper()
+        for itv in data.historial_itvs:
+            resultado = itv.get('resultado', '')  # Uppercased by DGTParser
             
             # a) Ignore DESFAVORABLE or NEGATIVA
-            if 'DESFAVORABLE' in resultado or 'NEGATIVA' in resultado:
+            if resultado in _BAD_RESULTS:
                 continue
             
-            valid_itvs.append(itv)
-        
-        # Separate ITVs with km > 0 from those with km = 0
-        itvs_with_km = [itv for itv in valid_itvs if itv.get('kilometros', 0) > 0]
+            fecha = itv_date(itv)
+            if latest_valid is None or fecha > itv_date(latest_valid):
+                latest_valid = itv
+            
+            # b) Prefer ITVs with kilometers
+            if itv.get('kilometros', 0) <= 0:
+                continue
+            
+            count_with_km += 1
+            if ultima is None or fecha > itv_date(ultima):
+                ultima, penultima = itv, ultima
+            elif penultima is None or fecha > itv_date(penultima):
+                penultima = itv
         
-        # Prefer ITVs with kilometers
-        if len(itvs_with_km) >= 2:
-            # We have at least 2 ITVs with km readings - use those
-            working_itvs = itvs_with_km
-        elif len(itvs_with_km) == 1:
+        # Use the two most recent ITVs with km > 0 (DGT already validated km readings)
+        # No filtering for decreasing km - handles odometer resets
+        if count_with_km == 1:
             # Only one ITV with km - can't calculate CAEs
             result['comentarios'].append("El vehículo no es susceptible de generar CAEs")
             return
-        else:
+        elif count_with_km == 0:
             # No ITVs with km readings
-            if valid_itvs:
+            if latest_valid is not None:
                 result['comentarios'].append("ITVs válidas sin lecturas de kilometraje")
-                result['fecha_ult'] = valid_itvs[0]['fecha_itv']
+                result['fecha_ult'] = latest_valid['fecha_itv']
             else:
                 result['comentarios'].append("Sin ITVs válidas (todas DESFAVORABLE/NEGATIVA)")
             return
         
-        # Use all ITVs with km > 0 (DGT already validated km readings)
-        # No filtering for decreasing km - handles odometer resets
-        if len(working_itvs) < 2:
-            if working_itvs:
-                itv = working_itvs[0]
-                result['fecha_ult'] = itv['fecha_itv']
-                result['lectura_k_ult'] = itv['kilometros']
-                result['comentarios'].append("Solo una ITV válida con kilometraje consistente")
-            return
-        
-        # Select última (most recent) and penúltima (second most recent)
-        ultima = working_itvs[0]
-        penultima = working_itvs[1]
-        
         # Safety check: ensure they're different
         if ultima['fecha_itv'] == penultima['fecha_itv'] and ultima['kilometros'] == penultima['kilometros']:
             result['comentarios'].append("El vehículo no es susceptible de generar CAEs")
@@ -269,27 +309,3 @@ class BusinessLogic:
         # km int and km nac - not in PDF
         result['km_int'] = 0
         result['km_nac'] = 0
-    
-    def format_output_row(self, result: Dict) -> List[str]:
-        """Format result as output row"""
-        def fmt_date(d):
-            return d.strftime('%d/%m/%Y') if d else '-'
-        
-        def fmt_int(n):
-            return str(n) if n > 0 else '0'
-        
-        comentarios_str = '; '.join(result['comentarios']) if result['comentarios'] else ''
-        
-        return [
-            result['matricula'],
-            fmt_date(result['fecha_penulti']),
-            fmt_int(result['lectura_k_penulti']),
-            fmt_date(result['fecha_ult']),
-            fmt_int(result['lectura_k_ult']),
-            fmt_int(result['dias_entre']),
-            fmt_int(result['km_itvs']),
-            fmt_int(result['km_1_ano']),
-            fmt_int(result['km_int']),
-            fmt_int(result['km_nac']),
-            comentarios_str
-        ]
\ No newline at end of file
@@ -3,9 +3,28 @@ Main script - Process all DGT PDFs
 """
 
 import os
-import csv
-from .pdf_parser import DGTParser
-from .business_logic import BusinessLogic
+from functools import partial
+from typing import Dict, List
+from .business_logic import OUTPUT_KEYS
+from .worker import make_executor, process_one
+
+
+def format_output_table(results: List[Dict]):
+    """Format results as the output table, one vectorized pass per column"""
+    # Imported here, not at module level: worker processes re-import this
+    # module as __mp_main__ and never format output
+    import pandas as pd
+    
+    df = pd.DataFrame(results, columns=OUTPUT_KEYS)
+    
+    for col in OUTPUT_KEYS[1:-1]:
+        if col.startswith('fecha_'):
+            df[col] = pd.to_datetime(df[col]).dt.strftime('%d/%m/%Y').fillna('-')
+        else:
+            df[col] = df[col].where(df[col] > 0, 0).astype(str)
+    df['comentarios'] = df['comentarios'].str.join('; ').fillna('')
+    
+    return df
 
 
 def main():
@@ -29,22 +48,15 @@ def main():
     print(f"Modo: Procesar TODOS los vehículos (sin filtro de cliente)")
     print(f"{'='*70}\n")
     
-    # Initialize business logic
-    logic = BusinessLogic(cliente_nif=cliente_nif)
+    # Process all PDFs in parallel (map keeps CSV order deterministic)
+    pdf_paths = [os.path.join(pdf_dir, pdf_file) for pdf_file in pdf_files]
     
-    # Process all PDFs
-    results = []
-    
-    for pdf_file in pdf_files:
-        pdf_path = os.path.join(pdf_dir, pdf_file)
-        
-        # Parse PDF
-        parser = DGTParser(pdf_path)
-        data = parser.parse()
-        
-        # Apply business logic
-        result = logic.process_vehicle(data)
-        results.append(result)
+    with make_executor(cliente_nif) as executor:
+        results = list(executor.map(
+            partial(process_one, cliente_nif=cliente_nif),
+            pdf_paths,
+            chunksize=4
+        ))
     
     # Generate CSV output
     print("\n" + "="*70)
@@ -66,13 +78,10 @@ def main():
         'Comentarios'
     ]
     
-    with open(output_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(headers)
-        
-        for result in results:
-            row = logic.format_output_row(result)
-            writer.writerow(row)
+    # Format all rows at once and write in a single pass
+    df = format_output_table(results)
+    df.columns = headers
+    df.to_csv(output_file, index=False, encoding='utf-8', lineterminator='\r\n')
     
     print(f"✅ Tabla generada: {output_file}")
     print(f"✅ Total vehículos procesados: {len(results)}")
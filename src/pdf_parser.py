@@ -3,13 +3,105 @@ DGT Vehicle Report Parser - FIXED VERSION
 """
 
 import pdfplumber
+import gzip
+import hashlib
+import os
 import re
+import tempfile
+from functools import lru_cache
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from dataclasses import dataclass, field
 
 
-@dataclass
+# Regex patterns, compiled once at import time
+#
+# Labels and section headers are matched case-sensitively (DGT prints them
+# consistently), which lets the engine scan for the literal prefix; only
+# free-text values are case-insensitive via scoped (?i:...) groups.
+
+# Identification
+_RE_MATRICULA = re.compile(r'Matrícula:\s*([A-Z0-9]{4,7}\s?[A-Z]{3})')
+_RE_BASTIDOR = re.compile(r'Bastidor:\s*([A-Z0-9]{17})')
+_RE_MARCA = re.compile(r'Marca:\s*((?i:[A-Z\s\-])+?)(?=\s+F\.|$)')
+_RE_MODELO = re.compile(r'Modelo:\s*((?i:[A-Z0-9\s\-])+?)(?=\s+Renting:|$)')
+_RE_SERVICIO = re.compile(r'Servicio:\s*((?i:[A-ZÁ-ÚÑ\s\-])+?)(?=\s+Tipo)')
+_RE_TIPO = re.compile(r'Tipo de vehículo:\s*((?i:[A-ZÁ-ÚÑ\s\-\(\)])+?)(?=\n|ARRENDATARIO|CARGAS)')
+_RE_MASA = re.compile(r'Masa máxima:\s*(\d{4,6})')
+_RE_TARA = re.compile(r'Tara[:\s\(kg\)]*:\s*(\d{4,6})')
+
+# (VehicleData attribute, pattern, converter, log label, log unit)
+_IDENT_FIELDS = (
+    ('matricula', _RE_MATRICULA, str.strip, 'Matrícula', ''),
+    ('bastidor', _RE_BASTIDOR, str, 'Bastidor', ''),
+    ('marca', _RE_MARCA, str.strip, 'Marca', ''),
+    ('modelo', _RE_MODELO, str.strip, 'Modelo', ''),
+    ('servicio', _RE_SERVICIO, str.strip, 'Servicio', ''),
+    ('tipo_vehiculo', _RE_TIPO, str.strip, 'Tipo', ''),
+    ('masa_maxima', _RE_MASA, int, 'Masa', ' kg'),
+    ('tara', _RE_TARA, int, 'Tara', ' kg'),
+)
+
+# Titular / renting
+_RE_FILIACION = re.compile(r'Filiación:\s*((?i:[A-ZÁ-ÚÑ0-9\s\.\,\-])+?)(?=\n|Cotitulares:)')
+_RE_RENTING = re.compile(r'Renting:\s*((?i:Sí|Si|No))')  # Match both "Si" and "Sí"
+
+# ARRENDATARIO table rows: Fecha Inicio | Fecha fin | Filiacion
+# Example: 09/08/2022 25/10/2026 PAMPLONA T I TRANSPORTE INMEDIATO SL
+_RE_ARR_ROW = re.compile(r'(\d{2}/\d{2}/\d{4})\s+(\d{2}/\d{2}/\d{4})\s+([A-ZÁ-ÚÑ0-9\s\.\,\-]+?)(?=\n|$)')
+
+# Ownership history rows: DD/MM/YYYY (optional end date) Type
+_RE_HIST_TIT_ROW = re.compile(r'(\d{2}/\d{2}/\d{4})\s+(\d{2}/\d{2}/\d{4}|---)\s+([A-Za-zá-ú]+)')
+
+# ITV rows: DD/MM/YYYY DD/MM/YYYY Station FAVORABLE/DESFAVORABLE Kilometers
+# Flexible enough to work across different page formats
+_RE_ITV_LINE = re.compile(r'(\d{2}/\d{2}/\d{4})\s+(\d{2}/\d{2}/\d{4})\s+([\w-]+)\s+((?i:FAVORABLE(?:\s+CON)?|DESFAVORABLE|NEGATIVA))\s+(\d{1,3}(?:\.\d{3})*|---)')
+
+# Section markers, longest first so the alternation reports the most
+# specific one ("HISTORIAL DE BAJAS" rather than "HISTORIAL")
+_SECTION_MARKERS = (
+    'HISTORIAL DE TITULARES',
+    'HISTORIAL DE BAJAS',
+    'HISTORIAL',
+    'ARRENDATARIO',
+    'CARGAS',
+    'DATOS SEGURO',
+    'DATOS',
+    'INFORMACIÓN',
+)
+_RE_SECTION_MARKER = re.compile('|'.join(map(re.escape, _SECTION_MARKERS)))
+
+# Section header -> (terminators, runs to end of text if no terminator)
+_SECTIONS = {
+    'ARRENDATARIO': (('CARGAS', 'DATOS SEGURO', 'HISTORIAL'), False),
+    'HISTORIAL DE TITULARES': (('HISTORIAL', 'DATOS'), True),
+    'HISTORIAL DE BAJAS': (('HISTORIAL', 'INFORMACIÓN'), True),
+}
+
+# Deregistration rows: DD/MM/YYYY DD/MM/YYYY TYPE REASON
+_RE_BAJAS_ROW = re.compile(r'(\d{2}/\d{2}/\d{4})\s+(\d{2}/\d{2}/\d{4})\s+([A-Z]+)\s+([^\n]+)')
+
+
+@lru_cache(maxsize=1024)
+def _parse_ddmmyyyy(date_str: str) -> Optional[datetime]:
+    """DD/MM/YYYY -> datetime without strptime; dates repeat across sections"""
+    try:
+        day, month, year = date_str.split('/', 2)
+        return datetime(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text for comparison (remove extra spaces, uppercase)"""
+    return ' '.join(text.upper().split())
+
+
+def _quiet(*args, **kwargs):
+    """No-op stand-in for print when the parser is not verbose"""
+
+
+@dataclass(slots=True)
 class VehicleData:
     """Structured vehicle data from DGT report"""
     matricula: str = ""
@@ -38,17 +130,24 @@ class VehicleData:
 class DGTParser:
     """Parser for DGT vehicle reports"""
     
-    def __init__(self, pdf_path: str):
+    def __init__(self, pdf_path: str, verbose: bool = False, cache_dir: Optional[str] = None):
         self.pdf_path = pdf_path
+        self.verbose = verbose
+        # Optional on-disk cache of extracted text (extraction dominates parse time)
+        self.cache_dir = cache_dir
+        # Progress output is opt-in: stdout is a shared lock under batch runs
+        self._log = print if verbose else _quiet
         self.text = ""
+        self._sections: Dict[str, Tuple[int, int]] = {}
         
     def parse(self) -> VehicleData:
         """Main parsing method"""
-        print(f"\n{'='*60}")
-        print(f"📄 Procesando: {self.pdf_path}")
-        print(f"{'='*60}")
+        self._log(f"\n{'='*60}")
+        self._log(f"📄 Procesando: {self.pdf_path}")
+        self._log(f"{'='*60}")
         
         self._extract_text()
+        self._index_sections()
         
         data = VehicleData(pdf_filename=self.pdf_path)
         
@@ -60,112 +159,117 @@ class DGTParser:
         self._parse_historial_itvs(data)
         self._parse_historial_bajas(data)
         
-        self._print_summary(data)
+        if self.verbose:
+            self._print_summary(data)
         
         return data
     
     def _extract_text(self):
         """Extract all text from PDF - concatenate all pages"""
+        cache_path = self._text_cache_path()
+        if cache_path is not None and self._read_text_cache(cache_path):
+            self._log(f"✓ Texto en caché: {len(self.text)} caracteres")
+            return
+        
         with pdfplumber.open(self.pdf_path) as pdf:
             # ✅ NUEVO: Concatenar TODO el texto primero
             all_text = []
             for page in pdf.pages:
-                page_text = page.extract_text()
-                all_text.append(page_text)
+                all_text.append(page.extract_text() or "")
+                
+                # Release the page's cached chars/words/layout right away,
+                # otherwise every page stays in memory until the PDF closes
+                page.close()
 
             self.text = "\n".join(all_text)
 
-        print(f"✓ Texto extraído: {len(self.text)} caracteres")
+        if cache_path is not None:
+            self._write_text_cache(cache_path)
+        
+        self._log(f"✓ Texto extraído: {len(self.text)} caracteres")
+    
+    def _text_cache_path(self) -> Optional[str]:
+        """Cache file for this PDF, keyed by path, mtime and size"""
+        if self.cache_dir is None:
+            return None
+        
+        st = os.stat(self.pdf_path)
+        path_hash = hashlib.sha1(os.path.abspath(self.pdf_path).encode('utf-8')).hexdigest()[:12]
+        name = f"{os.path.basename(self.pdf_path)}.{path_hash}.{st.st_mtime_ns}.{st.st_size}.txt.gz"
+        return os.path.join(self.cache_dir, name)
+    
+    def _read_text_cache(self, cache_path: str) -> bool:
+        """Load cached text; False on miss or unreadable entry"""
+        try:
+            with gzip.open(cache_path, 'rt', encoding='utf-8') as f:
+                self.text = f.read()
+            return True
+        except (OSError, EOFError, UnicodeDecodeError):
+            return False
+    
+    def _write_text_cache(self, cache_path: str):
+        """Write cached text atomically so parallel workers never see partial files"""
+        tmp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Unique per writer - worker threads share one pid
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as raw, \
+                    gzip.open(raw, 'wt', encoding='utf-8', compresslevel=6) as f:
+                f.write(self.text)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            # The cache is best-effort: extraction already succeeded
+            self._log(f"  ⚠ No se pudo escribir la caché: {e}")
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
     
     def _parse_identificacion(self, data: VehicleData):
         """Parse vehicle identification"""
-        print("\n🔍 IDENTIFICACIÓN...")
-        
-        # Matrícula
-        match = re.search(r'Matrícula:\s*([A-Z0-9]{4,7}\s?[A-Z]{3})', self.text, re.I)
-        if match:
-            data.matricula = match.group(1).strip()
-            print(f"  ✓ Matrícula: {data.matricula}")
-        
-        # Bastidor
-        match = re.search(r'Bastidor:\s*([A-Z0-9]{17})', self.text, re.I)
-        if match:
-            data.bastidor = match.group(1)
-            print(f"  ✓ Bastidor: {data.bastidor}")
-        
-        # Marca
-        match = re.search(r'Marca:\s*([A-Z\s\-]+?)(?=\s+F\.|$)', self.text, re.I)
-        if match:
-            data.marca = match.group(1).strip()
-            print(f"  ✓ Marca: {data.marca}")
-        
-        # Modelo
-        match = re.search(r'Modelo:\s*([A-Z0-9\s\-]+?)(?=\s+Renting:|$)', self.text, re.I)
-        if match:
-            data.modelo = match.group(1).strip()
-            print(f"  ✓ Modelo: {data.modelo}")
-        
-        # Servicio
-        match = re.search(r'Servicio:\s*([A-ZÁ-ÚÑ\s\-]+?)(?=\s+Tipo)', self.text, re.I)
-        if match:
-            data.servicio = match.group(1).strip()
-            print(f"  ✓ Servicio: {data.servicio}")
-        
-        # Tipo de vehículo
-        match = re.search(r'Tipo de vehículo:\s*([A-ZÁ-ÚÑ\s\-\(\)]+?)(?=\n|ARRENDATARIO|CARGAS)', self.text, re.I)
-        if match:
-            data.tipo_vehiculo = match.group(1).strip()
-            print(f"  ✓ Tipo: {data.tipo_vehiculo}")
-        
-        # Masa máxima
-        match = re.search(r'Masa máxima:\s*(\d{4,6})', self.text, re.I)
-        if match:
-            data.masa_maxima = int(match.group(1))
-            print(f"  ✓ Masa: {data.masa_maxima} kg")
-        
-        # Tara
-        match = re.search(r'Tara[:\s\(kg\)]*:\s*(\d{4,6})', self.text, re.I)
-        if match:
-            data.tara = int(match.group(1))
-            print(f"  ✓ Tara: {data.tara} kg")
+        self._log("\n🔍 IDENTIFICACIÓN...")
+        
+        for attr, regex, convert, label, unit in _IDENT_FIELDS:
+            match = regex.search(self.text)
+            if match:
+                value = convert(match.group(1))
+                setattr(data, attr, value)
+                self._log(f"  ✓ {label}: {value}{unit}")
     
     def _parse_titular(self, data: VehicleData):
         """Parse current owner"""
-        print("\n🔍 TITULAR...")
+        self._log("\n🔍 TITULAR...")
         
-        match = re.search(r'Filiación:\s*([A-ZÁ-ÚÑ0-9\s\.\,\-]+?)(?=\n|Cotitulares:)', self.text, re.I)
+        match = _RE_FILIACION.search(self.text)
         if match:
             data.titular_actual = match.group(1).strip()
-            print(f"  ✓ Titular: {data.titular_actual}")
+            self._log(f"  ✓ Titular: {data.titular_actual}")
     
     def _parse_renting(self, data: VehicleData):
         """Parse renting info"""
-        print("\n🔍 RENTING...")
+        self._log("\n🔍 RENTING...")
         
-        # Match both "Si" and "Sí"
-        match = re.search(r'Renting:\s*(Sí|Si|No)', self.text, re.I)
+        match = _RE_RENTING.search(self.text)
         if match:
             renting_value = match.group(1).upper()
             data.es_renting = renting_value in ['SÍ', 'SI']
-            print(f"  ✓ Renting: {'Sí' if data.es_renting else 'No'}")
+            self._log(f"  ✓ Renting: {'Sí' if data.es_renting else 'No'}")
     
     def _parse_arrendatario(self, data: VehicleData):
         """Parse ARRENDATARIO section"""
-        print("\n🔍 ARRENDATARIO...")
+        self._log("\n🔍 ARRENDATARIO...")
         
         # Find ARRENDATARIO section
-        match = re.search(r'ARRENDATARIO\s+(.+?)(?=CARGAS|DATOS SEGURO|HISTORIAL)', self.text, re.I | re.DOTALL)
-        if not match:
-            print("  ⚠ Sección no encontrada")
+        bounds = self._sections.get('ARRENDATARIO')
+        if bounds is None:
+            self._log("  ⚠ Sección no encontrada")
             return
         
-        section = match.group(1)
-        
-        # Parse table rows: Fecha Inicio | Fecha fin | Filiacion
-        # Example: 09/08/2022 25/10/2026 PAMPLONA T I TRANSPORTE INMEDIATO SL
-        pattern = r'(\d{2}/\d{2}/\d{4})\s+(\d{2}/\d{2}/\d{4})\s+([A-ZÁ-ÚÑ0-9\s\.\,\-]+?)(?=\n|$)'
-        
-        for match in re.finditer(pattern, section):
+        # Parse table rows
+        now = datetime.now()
+        for match in _RE_ARR_ROW.finditer(self.text, *bounds):
             fecha_inicio = self._parse_date(match.group(1))
             fecha_fin = self._parse_date(match.group(2))
             filiacion = match.group(3).strip()
@@ -173,103 +277,83 @@ class DGTParser:
             arrendatario = {
                 'fecha_inicio': fecha_inicio,
                 'fecha_fin': fecha_fin,
-                'filiacion': filiacion
+                'filiacion': filiacion,
+                # Normalized once here for BusinessLogic client matching
+                'filiacion_norm': normalize_text(filiacion)
             }
             
             data.historial_arrendatarios.append(arrendatario)
             
             # Set current arrendatario (if active - fecha_fin is future)
-            if fecha_fin and fecha_fin > datetime.now():
+            if fecha_fin and fecha_fin > now:
                 data.arrendatario_actual = filiacion
         
-        print(f"  ✓ {len(data.historial_arrendatarios)} registros")
+        self._log(f"  ✓ {len(data.historial_arrendatarios)} registros")
         if data.arrendatario_actual:
-            print(f"  ✓ Actual: {data.arrendatario_actual}")
+            self._log(f"  ✓ Actual: {data.arrendatario_actual}")
     
     def _parse_historial_titulares(self, data: VehicleData):
         """Parse ownership history"""
-        print("\n🔍 HISTORIAL TITULARES...")
+        self._log("\n🔍 HISTORIAL TITULARES...")
         
-        match = re.search(r'HISTORIAL DE TITULARES\s+(.+?)(?=HISTORIAL|DATOS|$)', 
-                         self.text, re.I | re.DOTALL)
-        if not match:
-            print("  ⚠ Sección no encontrada")
+        bounds = self._sections.get('HISTORIAL DE TITULARES')
+        if bounds is None:
+            self._log("  ⚠ Sección no encontrada")
             return
         
-        section = match.group(1)
-        
-        # Pattern: DD/MM/YYYY (optional end date) Type
-        pattern = r'(\d{2}/\d{2}/\d{4})\s+(\d{2}/\d{2}/\d{4}|---)\s+([A-Za-zá-ú]+)'
-        
-        for match in re.finditer(pattern, section):
+        for match in _RE_HIST_TIT_ROW.finditer(self.text, *bounds):
             data.historial_titulares.append({
                 'fecha_inicio': self._parse_date(match.group(1)),
                 'fecha_fin': self._parse_date(match.group(2)) if match.group(2) != '---' else None,
                 'tipo': match.group(3)
             })
         
-        print(f"  ✓ {len(data.historial_titulares)} registros")
+        self._log(f"  ✓ {len(data.historial_titulares)} registros")
     
     def _parse_historial_itvs(self, data: VehicleData):
         """Parse ITV history - handles multi-page formats"""
-        print("\n🔍 HISTORIAL ITVs...")
+        self._log("\n🔍 HISTORIAL ITVs...")
         
-        # Strategy: Find ALL ITV entries across all pages
-        # Pattern: DD/MM/YYYY DD/MM/YYYY Station FAVORABLE/DESFAVORABLE Kilometers
+        # ITVs dated more than a year ahead are discarded
+        cutoff_date = datetime.now() + timedelta(days=365)
         
-        # More flexible pattern that works across different page formats
-        itv_pattern = r'(\d{2}/\d{2}/\d{4})\s+(\d{2}/\d{2}/\d{4})\s+([\w-]+)\s+(FAVORABLE(?:\s+CON)?|DESFAVORABLE|NEGATIVA)\s+(\d{1,3}(?:\.\d{3})*|---)'
-        
-        for match in re.finditer(itv_pattern, self.text, re.I):
-            fecha_itv = self._parse_date(match.group(1))
-            fecha_cad = self._parse_date(match.group(2))
+        # Strategy: Find ALL ITV entries across all pages - one finditer pass
+        for match in _RE_ITV_LINE.finditer(self.text):
+            fecha_itv_str, fecha_cad_str, estacion, resultado, km_str = match.groups()
             
             # Filter by date
-            cutoff_date = datetime.now() + timedelta(days=365)
+            fecha_itv = self._parse_date(fecha_itv_str)
             if fecha_itv and fecha_itv >= cutoff_date:
                 continue
             
-            estacion = match.group(3)
-            resultado = match.group(4).upper().replace(' ', '_')
-            
-            # Kilometers - remove thousands separator
-            km_str = match.group(5)
-            km_str = km_str.replace('.', '')
-            kilometros = self._parse_km(km_str) if km_str and km_str != '---' else 0
-            
             # Look for defects on the next line (optional)
             # This is a simplified approach - defects may span multiple lines
             defectos_str = ""
             
             itv = {
                 'fecha_itv': fecha_itv,
-                'fecha_caducidad': fecha_cad,
+                'fecha_caducidad': self._parse_date(fecha_cad_str),
                 'estacion': estacion,
-                'resultado': resultado,
-                'kilometros': kilometros,
+                'resultado': resultado.upper().replace(' ', '_'),
+                'kilometros': self._parse_km(km_str),  # Strips thousands separator, '---' -> 0
                 'defectos': defectos_str,
                 'gravedad': ''
             }
             
             data.historial_itvs.append(itv)
         
-        print(f"  ✓ {len(data.historial_itvs)} inspecciones")    
+        self._log(f"  ✓ {len(data.historial_itvs)} inspecciones")
+    
     def _parse_historial_bajas(self, data: VehicleData):
         """Parse deregistration history"""
-        print("\n🔍 HISTORIAL BAJAS...")
+        self._log("\n🔍 HISTORIAL BAJAS...")
         
-        match = re.search(r'HISTORIAL DE BAJAS\s+(.+?)(?=HISTORIAL|INFORMACIÓN|$)', 
-                         self.text, re.I | re.DOTALL)
-        if not match:
-            print("  ⚠ Sección no encontrada")
+        bounds = self._sections.get('HISTORIAL DE BAJAS')
+        if bounds is None:
+            self._log("  ⚠ Sección no encontrada")
             return
         
-        section = match.group(1)
-        
-        # Pattern: DD/MM/YYYY DD/MM/YYYY TYPE REASON
-        pattern = r'(\d{2}/\d{2}/\d{4})\s+(\d{2}/\d{2}/\d{4})\s+([A-Z]+)\s+(.+?)(?=\n|$)'
-        
-        for match in re.finditer(pattern, section):
+        for match in _RE_BAJAS_ROW.finditer(self.text, *bounds):
             data.historial_bajas.append({
                 'fecha_inicio': self._parse_date(match.group(1)),
                 'fecha_fin': self._parse_date(match.group(2)),
@@ -277,16 +361,42 @@ class DGTParser:
                 'motivo': match.group(4).strip()
             })
         
-        print(f"  ✓ {len(data.historial_bajas)} registros")
+        self._log(f"  ✓ {len(data.historial_bajas)} registros")
+    
+    def _index_sections(self):
+        """
+        Locate every section body in a single pass over the text
+
+        Body = after the literal header (which must be followed by
+        whitespace), up to the first terminator. DGT section headers are
+        always uppercase.
+        """
+        text = self.text
+        markers = [(m.start(), m.group()) for m in _RE_SECTION_MARKER.finditer(text)]
+        
+        self._sections = {}
+        for header, (terminators, to_end) in _SECTIONS.items():
+            start = next(
+                (pos + len(header) for pos, marker in markers
+                 if marker == header and text[pos + len(header):pos + len(header) + 1].isspace()),
+                None
+            )
+            if start is None:
+                continue
+            
+            # "HISTORIAL" also ends at "HISTORIAL DE ...", "DATOS" at "DATOS SEGURO"
+            end = next(
+                (pos for pos, marker in markers if pos >= start and marker.startswith(terminators)),
+                len(text) if to_end else None
+            )
+            if end is not None:
+                self._sections[header] = (start, end)
     
     def _parse_date(self, date_str: str) -> Optional[datetime]:
         """Parse DD/MM/YYYY date"""
         if not date_str or date_str in ['---', '']:
             return None
-        try:
-            return datetime.strptime(date_str.strip(), '%d/%m/%Y')
-        except:
-            return None
+        return _parse_ddmmyyyy(date_str.strip())
     
     def _parse_km(self, km_str: str) -> int:
         """Parse kilometer value"""
@@ -298,7 +408,7 @@ class DGTParser:
             return 0
     
     def _print_summary(self, data: VehicleData):
-        """Print summary"""
+        """Print summary (parse() only calls this when verbose)"""
         print(f"\n{'='*60}")
         print(f"✅ RESUMEN")
         print(f"{'='*60}")
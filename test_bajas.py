@@ -1,17 +1,30 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 from src.pdf_parser import DGTParser
 
-# Vehículos que deberían tener bajas
-for matricula in ['9952HPL', '9990JJY']:
-    pdf_path = f"data/pdfs/{matricula}.pdf"
-    parser = DGTParser(pdf_path)
-    data = parser.parse()
+
+def _parse_one(pdf_path):
+    # Non-verbose: per-PDF parser chatter would interleave across workers.
+    # Extracted text is cached in .cache/ so re-runs skip pdfplumber.
+    return DGTParser(pdf_path, verbose=False, cache_dir='.cache').parse()
+
+
+if __name__ == "__main__":
+    # Vehículos que deberían tener bajas
+    matriculas = ['9952HPL', '9990JJY']
+    pdf_paths = [f"data/pdfs/{matricula}.pdf" for matricula in matriculas]
+    
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = list(executor.map(_parse_one, pdf_paths))
     
-    print(f"\n{'='*60}")
-    print(f"{matricula} - Bajas:")
-    print(f"{'='*60}")
-    for baja in data.historial_bajas:
-        print(f"  Fecha inicio: {baja['fecha_inicio']}")
-        print(f"  Fecha fin: {baja['fecha_fin']}")
-        print(f"  Tipo: {baja['tipo']}")
-        print(f"  Motivo: {baja['motivo']}")
-        print()
+    for matricula, data in zip(matriculas, results):
+        print(f"\n{'='*60}")
+        print(f"{matricula} - Bajas:")
+        print(f"{'='*60}")
+        for baja in data.historial_bajas:
+            print(f"  Fecha inicio: {baja['fecha_inicio']}")
+            print(f"  Fecha fin: {baja['fecha_fin']}")
+            print(f"  Tipo: {baja['tipo']}")
+            print(f"  Motivo: {baja['motivo']}")
+            print()